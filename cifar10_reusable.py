@@ -45,6 +45,14 @@ import tensorflow as tf
 
 import cifar10_input_nostd
 
+# Let FP32 matmul/conv run on tensor cores (TF32) on Ampere and later;
+# a no-op on older GPUs and TF versions without the switch.
+os.environ.setdefault('NVIDIA_TF32_OVERRIDE', '1')
+try:
+  tf.config.experimental.enable_tensor_float_32_execution(True)
+except AttributeError:
+  pass
+
 FLAGS = tf.app.flags.FLAGS
 
 # Basic model parameters.
@@ -95,11 +103,13 @@ def _activation_summary(x):
                                        tf.nn.zero_fraction(x))
 
 
-shared_variables = {}
-
 def _variable_on_cpu(name, shape, initializer):
   """Helper to create a Variable stored on CPU memory.
 
+  AUTO_REUSE lets inference() be called several times (e.g. on benign
+  and adversarial batches) while sharing one set of variables, without
+  duplicating them or needing a side cache.
+
   Args:
     name: name of the variable
     shape: list of ints
@@ -108,13 +118,10 @@ def _variable_on_cpu(name, shape, initializer):
   Returns:
     Variable Tensor
   """
-  key = (tf.get_variable_scope().name, name)
-  if key in shared_variables:
-    return shared_variables[key]
   # with tf.device('/cpu:0'):
   dtype = tf.float16 if FLAGS.use_fp16 else tf.float32
-  var = tf.get_variable(name, shape, initializer=initializer, dtype=dtype)
-  shared_variables[key] = var
+  with tf.variable_scope(tf.get_variable_scope(), reuse=tf.AUTO_REUSE):
+    var = tf.get_variable(name, shape, initializer=initializer, dtype=dtype)
   return var
 
 
@@ -307,6 +314,27 @@ def loss(logits, labels):
   return tf.add_n(tf.get_collection('losses'), name='total_loss')
 
 
+def loss_sparse(logits, labels):
+  """Mean cross entropy from integer labels, and nothing else.
+
+  Unlike loss(), this neither touches the 'losses' collection nor adds
+  the weight decay terms, so it suits paths that only need a loss to
+  differentiate through (e.g. crafting adversarial examples from
+  argmax labels) without allocating one-hot targets.
+
+  Args:
+    logits: Logits from inference().
+    labels: int labels. 1-D tensor of shape [batch_size]
+
+  Returns:
+    Loss tensor of type float.
+  """
+  labels = tf.cast(labels, tf.int64)
+  cross_entropy = tf.nn.sparse_softmax_cross_entropy_with_logits(
+      labels=labels, logits=logits, name='sparse_cross_entropy_per_example')
+  return tf.reduce_mean(cross_entropy, name='sparse_cross_entropy')
+
+
 def _add_loss_summaries(total_loss):
   """Add summaries for losses in CIFAR-10 model.
 
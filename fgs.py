@@ -2,41 +2,58 @@ import keras.backend as K
 from attack_utils import gen_grad
 import tensorflow as tf
 
+# XLA fuses the sign -> *eps -> +x -> clip chain into one elementwise
+# kernel instead of a separate launch per op. Fall back to a no-op
+# scope on TF builds without XLA.
+try:
+    _jit_scope = tf.xla.experimental.jit_scope
+except AttributeError:
+    try:
+        from tensorflow.contrib.compiler import jit as _xla_jit
+        _jit_scope = _xla_jit.experimental_jit_scope
+    except ImportError:
+        from contextlib import contextmanager
+
+        @contextmanager
+        def _jit_scope(compile_ops=True):
+            yield
+
 def symbolic_fgs(x, grad, eps=0.3, clipping=True):
     """
     FGSM attack.
     """
+    with _jit_scope(compile_ops=True):
+        # signed gradient
+        normed_grad = K.sign(grad)
 
-    # signed gradient
-    normed_grad = K.sign(grad)
-
-    # Multiply by constant epsilon
-    scaled_grad = eps * normed_grad
+        # Multiply by constant epsilon
+        scaled_grad = eps * normed_grad
 
-    # Add perturbation to original example to obtain adversarial example
-    adv_x = K.stop_gradient(x + scaled_grad)
+        # Add perturbation to original example to obtain adversarial example
+        adv_x = K.stop_gradient(x + scaled_grad)
 
-    if clipping:
-        adv_x = K.clip(adv_x, 0, 1)
+        if clipping:
+            adv_x = K.clip(adv_x, 0, 1)
     return adv_x
 
 def symbolic_fg(x, grad, eps=0.3, clipping=True):
     """
     FG attack
     """
-    # Unit vector in direction of gradient
-    reduc_ind = list(xrange(1, len(x.get_shape())))
-    normed_grad = grad / tf.sqrt(tf.reduce_sum(tf.square(grad),
+    with _jit_scope(compile_ops=True):
+        # Unit vector in direction of gradient
+        reduc_ind = list(range(1, len(x.get_shape())))
+        normed_grad = grad / tf.sqrt(tf.reduce_sum(tf.square(grad),
                                                    reduction_indices=reduc_ind,
                                                    keep_dims=True))
-    # Multiply by constant epsilon
-    scaled_grad = eps * normed_grad
+        # Multiply by constant epsilon
+        scaled_grad = eps * normed_grad
 
-    # Add perturbation to original example to obtain adversarial example
-    adv_x = K.stop_gradient(x + scaled_grad)
+        # Add perturbation to original example to obtain adversarial example
+        adv_x = K.stop_gradient(x + scaled_grad)
 
-    if clipping:
-        adv_x = K.clip(adv_x, 0, 1)
+        if clipping:
+            adv_x = K.clip(adv_x, 0, 1)
 
     return adv_x
 
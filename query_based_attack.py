@@ -89,14 +89,29 @@ def round_array(array, divider):
 
 
 
-def xent_est(prediction, x, x_plus_i, x_minus_i, curr_target):
+def batched_probe(prediction, x, x_plus_i, x_minus_i):
+    """
+    Evaluate the +delta and -delta probes in a single concatenated
+    forward pass when the input placeholder has a flexible batch
+    dimension, halving the per-query launch overhead. Falls back to
+    two separate runs for graphs built with a fixed batch size.
+    """
+    if x.get_shape().as_list()[0] is None:
+        pred_both = sess.run(prediction,
+                             feed_dict={x: np.concatenate([x_plus_i,
+                                                           x_minus_i])})
+        return pred_both[:len(x_plus_i)], pred_both[len(x_plus_i):]
     pred_plus = sess.run(prediction, feed_dict={x: x_plus_i})
+    pred_minus = sess.run(prediction, feed_dict={x: x_minus_i})
+    return pred_plus, pred_minus
+
+def xent_est(prediction, x, x_plus_i, x_minus_i, curr_target):
+    pred_plus, pred_minus = batched_probe(prediction, x, x_plus_i, x_minus_i)
     if args.round_counter:
         pred_plus = round_array(pred_plus, ROUND_PARAM)
     elif args.noise_counter:
         pred_plus = noise_add(pred_plus)
     pred_plus_t = pred_plus[np.arange(BATCH_SIZE), list(curr_target)]
-    pred_minus = sess.run(prediction, feed_dict={x: x_minus_i})
     if args.round_counter:
         pred_minus = round_array(pred_minus, ROUND_PARAM)
     elif args.noise_counter:
@@ -119,8 +134,8 @@ def CW_est(prediction, logits, x, x_plus_i, x_minus_i, curr_sample, curr_target)
     curr_logits[np.arange(BATCH_SIZE), list(curr_target)] = -1e4
     max_indices = np.argmax(curr_logits, 1)
 
-    # logit_plus = sess.run(logits, feed_dict={x: x_plus_i})
-    prediction_plus = sess.run(prediction, feed_dict={x: x_plus_i})
+    prediction_plus, prediction_minus = batched_probe(prediction, x,
+                                                      x_plus_i, x_minus_i)
     if args.round_counter:
         prediction_plus = round_array(prediction_plus, ROUND_PARAM)
     elif args.noise_counter:
@@ -129,7 +144,6 @@ def CW_est(prediction, logits, x, x_plus_i, x_minus_i, curr_sample, curr_target)
     logit_plus_t = logit_plus[np.arange(BATCH_SIZE), list(curr_target)]
     logit_plus_max = logit_plus[np.arange(BATCH_SIZE), list(max_indices)]
 
-    prediction_minus = sess.run(prediction, feed_dict={x: x_minus_i})
     if args.round_counter:
         prediction_minus = round_array(prediction_minus, ROUND_PARAM)
     elif args.noise_counter:
@@ -718,7 +732,15 @@ np.random.seed(0)
 tf.set_random_seed(0)
 
 if 'pso' not in args.method:
-    x = tf.placeholder(shape=(BATCH_SIZE,
+    # The MNIST Keras models accept any batch size, so leave the batch
+    # dimension flexible there to let batched_probe fuse the +delta and
+    # -delta forward passes. The CIFAR-10/Imagenet graphs are built for
+    # a fixed batch size and keep it.
+    if args.dataset == 'MNIST':
+        x_batch_size = None
+    else:
+        x_batch_size = BATCH_SIZE
+    x = tf.placeholder(shape=(x_batch_size,
                        IMAGE_ROWS,
                        IMAGE_COLS,
                        NUM_CHANNELS),dtype=tf.float32)
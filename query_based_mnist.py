@@ -53,10 +53,21 @@ def pca_components(X, dim):
     return U_norm[:,:args.num_comp]
 
 
+def batched_probe(tensor, x, x_plus_i, x_minus_i):
+    """
+    Evaluate the +delta and -delta probes in a single concatenated
+    forward pass, halving the per-query launch overhead. The input
+    placeholder has a flexible batch dimension, so the Keras models
+    accept the doubled batch.
+    """
+    out_both = K.get_session().run([tensor],
+                                   feed_dict={x: np.concatenate([x_plus_i,
+                                                                 x_minus_i])})[0]
+    return out_both[:len(x_plus_i)], out_both[len(x_plus_i):]
+
 def xent_est(prediction, x, x_plus_i, x_minus_i, curr_target):
-    pred_plus = K.get_session().run([prediction], feed_dict={x: x_plus_i})[0]
+    pred_plus, pred_minus = batched_probe(prediction, x, x_plus_i, x_minus_i)
     pred_plus_t = pred_plus[np.arange(BATCH_SIZE), list(curr_target)]
-    pred_minus = K.get_session().run([prediction], feed_dict={x: x_minus_i})[0]
     pred_minus_t = pred_minus[np.arange(BATCH_SIZE), list(curr_target)]
     single_grad_est = (pred_plus_t - pred_minus_t)/args.delta
 
@@ -68,11 +79,10 @@ def CW_est(logits, x, x_plus_i, x_minus_i, curr_sample, curr_target):
     # target
     curr_logits[np.arange(BATCH_SIZE), list(curr_target)] = -1e4
     max_indices = np.argmax(curr_logits, 1)
-    logit_plus = K.get_session().run([logits], feed_dict={x: x_plus_i})[0]
+    logit_plus, logit_minus = batched_probe(logits, x, x_plus_i, x_minus_i)
     logit_plus_t = logit_plus[np.arange(BATCH_SIZE), list(curr_target)]
     logit_plus_max = logit_plus[np.arange(BATCH_SIZE), list(max_indices)]
 
-    logit_minus = K.get_session().run([logits], feed_dict={x: x_minus_i})[0]
     logit_minus_t = logit_minus[np.arange(BATCH_SIZE), list(curr_target)]
     logit_minus_max = logit_minus[np.arange(BATCH_SIZE), list(max_indices)]
 